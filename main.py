@@ -1,18 +1,23 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from sse_starlette.sse import EventSourceResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any, AsyncGenerator
+from typing import Optional, List, Dict, Any, AsyncGenerator, Callable, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass
 import os
 import uuid
 import time
 import sys
 import asyncio
+import io
+import hashlib
 import logging
-import json
+import re
+import orjson
 from pathlib import Path
-import random
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import NoCredentialsError, ClientError
 import mimetypes # To determine content type
 
@@ -23,18 +28,11 @@ load_dotenv()
 # Add parent directory to path to import agent module
 sys.path.append(str(Path(__file__).parent.parent))
 from src.agt.agent import graph as agt_graph, VaaniState
-from langchain_core.messages import HumanMessage, AIMessage
-
-# Import model clients
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_anthropic import ChatAnthropic
-from langchain_groq import ChatGroq
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
 
 # Import the react_agent modules
 from src.react_agent import graph as react_graph
 from src.react_agent.state import InputState
-from src.react_agent.configuration import Configuration
 from src.react_agent.utils import load_chat_model
 
 # Add this import for Anthropic exceptions
@@ -74,9 +72,21 @@ required_keys = {
 
 for key, model_name in required_keys.items():
     if not os.getenv(key):
-        logger.warning(f"Warning: {key} is not set. {model_name} will not be available.")
+        logger.warning("Warning: %s is not set. %s will not be available.", key, model_name)
     else:
-        logger.info(f"Found API key for {model_name}")
+        logger.info("Found API key for %s", model_name)
+
+# EventSourceResponse always sends X-Accel-Buffering: no; pin Cache-Control to no-store so
+# streamed responses are never cached, whatever default the installed sse-starlette uses
+STREAM_HEADERS = {"Cache-Control": "no-store"}
+
+# Streaming payloads are serialized with orjson; EventSourceResponse adds the SSE framing
+def encode_frame(payload: Dict[str, Any]) -> Dict[str, str]:
+    """Convert a streaming payload into a server-sent event named after its type."""
+    return {"event": payload["type"], "data": orjson.dumps(payload).decode()}
+
+# Map frontend message roles to LangChain message classes
+_ROLE_MAP = {"user": HumanMessage, "assistant": AIMessage}
 
 # Models for request/response
 class Message(BaseModel):
@@ -101,61 +111,85 @@ class StreamingChatResponse(BaseModel):
     message: Message
     thread_id: str
 
-# Model mapping for direct access with API keys from environment variables
-def get_model_clients():
+# Snapshot of provider API keys, read once at startup
+@dataclass(frozen=True)
+class ProviderKeys:
+    openai: Optional[str]
+    google: Optional[str]
+    anthropic: Optional[str]
+    groq: Optional[str]
+
+    @classmethod
+    def from_env(cls) -> "ProviderKeys":
+        return cls(
+            openai=os.getenv("OPENAI_API_KEY"),
+            google=os.getenv("GOOGLE_API_KEY"),
+            anthropic=os.getenv("ANTHROPIC_API_KEY"),
+            groq=os.getenv("GROQ_API_KEY"),
+        )
+
+PROVIDER_KEYS = ProviderKeys.from_env()
+
+# Model mapping for direct access with API keys captured from the startup snapshot
+def get_model_clients(keys: ProviderKeys = PROVIDER_KEYS):
     clients = {}
     
+    # Provider client libraries are imported only when their API key is configured
     # OpenAI models - requires OPENAI_API_KEY
-    if os.getenv("OPENAI_API_KEY"):
+    if keys.openai:
+        from langchain_openai import ChatOpenAI
         clients["gpt-4o-mini"] = lambda: ChatOpenAI(
             model="gpt-4o-mini", 
-            api_key=os.getenv("OPENAI_API_KEY"),
+            api_key=keys.openai,
             streaming=True  # Enable streaming by default
         )
         clients["gpt-4o"] = lambda: ChatOpenAI(
             model="gpt-4o", 
-            api_key=os.getenv("OPENAI_API_KEY"),
+            api_key=keys.openai,
             streaming=True
         )
     
     # Google models - requires GOOGLE_API_KEY
-    if os.getenv("GOOGLE_API_KEY"):
+    if keys.google:
+        from langchain_google_genai import ChatGoogleGenerativeAI
         clients["gemini-1.5-flash"] = lambda: ChatGoogleGenerativeAI(
             model="gemini-1.5-flash", 
-            google_api_key=os.getenv("GOOGLE_API_KEY"),
+            google_api_key=keys.google,
             streaming=True
         )
         clients["gemini-1.5-pro"] = lambda: ChatGoogleGenerativeAI(
             model="gemini-1.5-pro", 
-            google_api_key=os.getenv("GOOGLE_API_KEY"),
+            google_api_key=keys.google,
             streaming=True
         )
     
     # Anthropic models - requires ANTHROPIC_API_KEY
-    if os.getenv("ANTHROPIC_API_KEY"):
+    if keys.anthropic:
+        from langchain_anthropic import ChatAnthropic
         clients["claude-3-haiku-20240307"] = lambda: ChatAnthropic(
             model="claude-3-haiku-20240307", 
-            anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
+            anthropic_api_key=keys.anthropic,
             streaming=True
         )
         clients["claude-3-opus-20240229"] = lambda: ChatAnthropic(
             model="claude-3-opus-20240229", 
-            anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
+            anthropic_api_key=keys.anthropic,
             streaming=True
         )
     
     # Groq models - requires GROQ_API_KEY
-    if os.getenv("GROQ_API_KEY"):
+    if keys.groq:
+        from langchain_groq import ChatGroq
         # Using Llama 3 models from Groq
         clients["llama-3.3-70b-versatile"] = lambda: ChatGroq(
             model="llama-3.3-70b-versatile",
-            api_key=os.getenv("GROQ_API_KEY"),
+            api_key=keys.groq,
             streaming=True
         )
         # Add another Groq model option
         clients["mixtral-8x7b-32768"] = lambda: ChatGroq(
             model="mixtral-8x7b-32768",
-            api_key=os.getenv("GROQ_API_KEY"),
+            api_key=keys.groq,
             streaming=True
         )
     
@@ -168,10 +202,36 @@ MODEL_CLIENTS = get_model_clients()
 if not MODEL_CLIENTS:
     logger.error("No model clients could be initialized. Please check your API keys.")
 
+# Model used when a request asks for one that is not available
+_DEFAULT_MODEL = "gpt-4o-mini" if "gpt-4o-mini" in MODEL_CLIENTS else next(iter(MODEL_CLIENTS), None)
+
+# Constructed model clients, reused across requests so their HTTP connection pools are shared
+_INSTANCE_CACHE: Dict[str, Any] = {}
+
+def get_client(name: str):
+    """Return the cached client for a model, constructing it on first use."""
+    client = _INSTANCE_CACHE.get(name)
+    if client is None:
+        client = _INSTANCE_CACHE[name] = MODEL_CLIENTS[name]()
+    return client
+
 # Check for Tavily API key (needed for search tool)
 if not os.getenv("TAVILY_API_KEY"):
     logger.warning("TAVILY_API_KEY not set. React agent search functionality will be limited.")
 
+# Map the model names to the "provider/model" format expected by react_agent
+MODEL_NAME_MAPPING = {
+    "gemini-1.5-flash": "google/gemini-1.5-flash",
+    "gpt-4o-mini": "openai/gpt-4o-mini",
+    "gpt-4o": "openai/gpt-4o",
+    "claude-3-haiku-20240307": "anthropic/claude-3-haiku-20240307",
+    "llama-3.3-70b-versatile": "groq/llama-3.3-70b-versatile",
+    "mixtral-8x7b-32768": "groq/mixtral-8x7b-32768"
+}
+
+# Models tried, in order, as the react agent fallback
+FALLBACK_ORDER = ("gpt-4o-mini", "gemini-1.5-flash", "llama-3.3-70b-versatile")
+
 # New model for the request
 class ReactAgentRequest(BaseModel):
     messages: List[Message]
@@ -193,7 +253,7 @@ R2_CONFIGURED = all([CLOUDFLARE_ACCOUNT_ID, CLOUDFLARE_ACCESS_KEY_ID, CLOUDFLARE
 if not R2_CONFIGURED:
     logger.warning("Cloudflare R2 credentials not fully configured. File uploads will be disabled.")
 else:
-    logger.info(f"Cloudflare R2 configured for bucket: {R2_BUCKET_NAME}")
+    logger.info("Cloudflare R2 configured for bucket: %s", R2_BUCKET_NAME)
     # Initialize R2 client (using boto3 for S3 compatibility)
     s3_client = boto3.client(
         's3',
@@ -203,6 +263,13 @@ else:
         region_name='auto', # R2 uses 'auto'
     )
 
+# Stream uploads to R2 in fixed-size pieces instead of reading whole files into memory
+R2_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    io_chunksize=1024 * 1024,
+)
+
 # --- Modify handle_file_upload to upload to R2 ---
 # Utility functions
 # def handle_file_upload(file: UploadFile) -> str:
@@ -229,37 +296,40 @@ async def upload_to_r2(file: UploadFile) -> str:
         raise HTTPException(status_code=501, detail="R2 storage is not configured.")
 
     try:
-        timestamp = int(time.time())
         file_extension = os.path.splitext(file.filename)[1]
         # Sanitize filename slightly (optional, but good practice)
         base_filename = os.path.splitext(file.filename)[0].replace(" ", "_").replace("/", "_")
-        unique_filename = f"{timestamp}_{uuid.uuid4().hex}_{base_filename}{file_extension}"
+        unique_filename = f"{uuid.uuid4().hex}_{base_filename}{file_extension}"
 
         # Determine content type
         content_type, _ = mimetypes.guess_type(unique_filename)
         if content_type is None:
             content_type = 'application/octet-stream' # Default if guess fails
 
-        # Read file content into memory (consider streaming for large files if needed)
-        file_content = await file.read()
-        await file.close()
+        logger.info("Uploading %s (%s) to R2 bucket %s...", unique_filename, content_type, R2_BUCKET_NAME)
 
-        logger.info(f"Uploading {unique_filename} ({content_type}) to R2 bucket {R2_BUCKET_NAME}...")
-
-        s3_client.put_object(
-            Bucket=R2_BUCKET_NAME,
-            Key=unique_filename,
-            Body=file_content,
-            ContentType=content_type
-            # ACL='public-read' # Only if your bucket policy allows public reads explicitly
-        )
+        # Stream the spooled upload straight to R2 in a worker thread so memory stays
+        # bounded by the transfer chunk size and the event loop is not blocked
+        try:
+            await file.seek(0)
+            await asyncio.to_thread(
+                s3_client.upload_fileobj,
+                file.file,
+                R2_BUCKET_NAME,
+                unique_filename,
+                # Add "ACL": "public-read" only if your bucket policy allows public reads explicitly
+                ExtraArgs={"ContentType": content_type},
+                Config=R2_TRANSFER_CONFIG,
+            )
+        finally:
+            await file.close()
 
-        logger.info(f"Successfully uploaded {unique_filename} to R2.")
+        logger.info("Successfully uploaded %s to R2.", unique_filename)
 
         # Return public URL if base is configured, otherwise generate presigned URL
         if R2_PUBLIC_URL_BASE:
             file_url = f"{R2_PUBLIC_URL_BASE}/{unique_filename}"
-            logger.info(f"Returning public R2 URL: {file_url}")
+            logger.info("Returning public R2 URL: %s", file_url)
             return file_url
         else:
             # Generate a presigned URL (valid for 1 hour by default)
@@ -269,17 +339,17 @@ async def upload_to_r2(file: UploadFile) -> str:
                 Params={'Bucket': R2_BUCKET_NAME, 'Key': unique_filename},
                 ExpiresIn=3600  # URL expires in 1 hour
             )
-            logger.info(f"Returning presigned R2 URL (expires in 1hr): {presigned_url}")
+            logger.info("Returning presigned R2 URL (expires in 1hr): %s", presigned_url)
             return presigned_url
 
     except NoCredentialsError:
         logger.error("R2 credentials not found.")
         raise HTTPException(status_code=500, detail="R2 storage credentials error.")
     except ClientError as e:
-        logger.error(f"R2 Client Error: {e}")
+        logger.error("R2 Client Error: %s", e)
         raise HTTPException(status_code=500, detail=f"R2 storage error: {e.response['Error']['Message']}")
     except Exception as e:
-        logger.error(f"Error uploading to R2: {e}", exc_info=True)
+        logger.error("Error uploading to R2: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to upload file to R2: {str(e)}")
 
 @app.post("/api/upload")
@@ -300,33 +370,28 @@ async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
         # Use request.stream directly instead of model_dump().get()
         stream = request.stream
         
-        # Convert frontend messages to LangChain format
-        langchain_messages = []
-        for msg in request.messages:
-            if msg.role == "user":
-                # Fix: Ensure content is not empty
-                content = msg.content.strip() if msg.content else "Hello"
-                langchain_messages.append(HumanMessage(content=content))
-            elif msg.role == "assistant":
-                # Fix: Ensure content is not empty
-                content = msg.content.strip() if msg.content else "I'm an AI assistant."
-                langchain_messages.append(AIMessage(content=content))
+        # Convert frontend messages to LangChain format, ensuring content is not empty
+        langchain_messages = [
+            _ROLE_MAP[msg.role](content=(msg.content or ("Hello" if msg.role == "user" else "I'm an AI assistant.")).strip())
+            for msg in request.messages
+            if msg.role in _ROLE_MAP
+        ]
         
         # Ensure we have at least one message
         if not langchain_messages:
             langchain_messages = [HumanMessage(content="Hello")]
         
         # Log the incoming request with emphasis on the selected model
-        logger.info(f"Received chat request: model={request.model}, thread_id={thread_id}, use_agent={request.use_agent}, stream={stream}")
+        logger.info("Received chat request: model=%s, thread_id=%s, use_agent=%s, stream=%s", request.model, thread_id, request.use_agent, stream)
         
         # Get the model name from the current request (allowing model switching)
         backend_model = request.model
-        logger.info(f"Using model for this message: {backend_model}")
+        logger.info("Using model for this message: %s", backend_model)
         
         # If streaming is requested, handle it differently
         if stream:
             # Return a streaming response
-            return StreamingResponse(
+            return EventSourceResponse(
                 stream_chat_response(
                     messages=langchain_messages,
                     model=backend_model,
@@ -335,12 +400,12 @@ async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
                     deep_research=request.deep_research,
                     file_url=request.file_url
                 ),
-                media_type="text/event-stream"
+                headers=STREAM_HEADERS
             )
         
         # Only use agent when requested via the bulb icon (use_agent=True)
         if request.use_agent:
-            logger.info(f"Using agent for chat with model: {backend_model}")
+            logger.info("Using agent for chat with model: %s", backend_model)
             
             # Prepare input state for the agent with proper structure
             input_state = VaaniState(
@@ -358,10 +423,12 @@ async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
             config = {"configurable": {"thread_id": thread_id}}
             
             # Process with agent with better error handling
-            logger.info(f"Processing with agent - Thread: {thread_id}, Model: {backend_model}")
+            logger.info("Processing with agent - Thread: %s, Model: %s", thread_id, backend_model)
             
             try:
-                # Wrap the synchronous invoke in asyncio.to_thread for async handling
+                # The agent graph uses synchronous nodes and a SqliteSaver checkpointer, which
+                # does not implement the async checkpoint API, so ainvoke is not an option here.
+                # Run the synchronous invoke in a worker thread instead.
                 result = await asyncio.to_thread(agt_graph.invoke, input_state, config)
                 
                 # Extract response with proper error checking
@@ -372,21 +439,21 @@ async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
                     elif isinstance(ai_message, dict) and "content" in ai_message:
                         response_content = ai_message["content"]
                     else:
-                        logger.warning(f"Unexpected message format: {type(ai_message)}")
+                        logger.warning("Unexpected message format: %s", type(ai_message))
                         response_content = "I couldn't process your request properly."
                 else:
                     logger.warning("No messages found in agent result")
                     response_content = "I couldn't process your request with the AI agent. Please try again."
                 
             except Exception as invoke_error:
-                logger.error(f"Error in agent processing: {invoke_error}", exc_info=True)
+                logger.error("Error in agent processing: %s", invoke_error, exc_info=True)
                 return ChatResponse(
                     message=Message(role="assistant", content=f"I encountered an error with the AI agent: {str(invoke_error)}"),
                     thread_id=thread_id
                 )
         else:
             # Direct model conversation without agent
-            logger.info(f"Using direct model conversation - Model: {backend_model}")
+            logger.info("Using direct model conversation - Model: %s", backend_model)
             
             # Check if we have a model client for the requested model
             if backend_model not in MODEL_CLIENTS:
@@ -397,31 +464,29 @@ async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
                         thread_id=thread_id
                     )
                 # Log available models for debugging
-                logger.warning(f"Available models: {list(MODEL_CLIENTS.keys())}")
-                logger.warning(f"Model {backend_model} not found, using first available model")
-                # If the model doesn't exist but we have some clients, use the first available
-                backend_model = next(iter(MODEL_CLIENTS.keys()))
-                logger.warning(f"Falling back to: {backend_model}")
+                logger.warning("Available models: %s", list(MODEL_CLIENTS))
+                logger.warning("Model %s not found, using default model", backend_model)
+                # If the model doesn't exist but we have some clients, use the default
+                backend_model = _DEFAULT_MODEL
+                logger.warning("Falling back to: %s", backend_model)
             
             try:
                 # Get the appropriate model client
-                model = MODEL_CLIENTS[backend_model]()
-                logger.info(f"Using model client for: {backend_model}")
+                model = get_client(backend_model)
+                logger.info("Using model client for: %s", backend_model)
                 
-                # Get response directly from the model
-                ai_response = await asyncio.to_thread(
-                    model.invoke, 
-                    langchain_messages
-                )
+                # Get response directly from the model using its native async client
+                ai_response = await model.ainvoke(langchain_messages)
                 response_content = ai_response.content
             except Exception as model_error:
-                logger.error(f"Error in model processing: {model_error}", exc_info=True)
+                logger.error("Error in model processing: %s", model_error, exc_info=True)
                 return ChatResponse(
                     message=Message(role="assistant", content=f"I encountered an error with the {backend_model} model: {str(model_error)}"),
                     thread_id=thread_id
                 )
         
-        logger.info(f"Generated response using {backend_model} (first 100 chars): {response_content[:100]}...")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Generated response using %s (first 100 chars): %s...", backend_model, response_content[:100])
         
         return ChatResponse(
             message=Message(role="assistant", content=response_content),
@@ -429,7 +494,7 @@ async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
         )
     
     except Exception as e:
-        logger.error(f"Error processing chat request: {e}", exc_info=True)
+        logger.error("Error processing chat request: %s", e, exc_info=True)
         return ChatResponse(
             message=Message(role="assistant", content=f"I encountered an error: {str(e)}"),
             thread_id=thread_id or str(uuid.uuid4())
@@ -443,26 +508,24 @@ async def stream_chat_response(messages, model, thread_id, use_agent, deep_resea
             # Skip initial status update for regular chat
             pass
         else:
-            yield json.dumps({"type": "status", "status": "Researching..."}) + "\n"
+            yield encode_frame({"type": "status", "status": "Researching..."})
 
         # Model client validation
         if model not in MODEL_CLIENTS:
-            logger.warning(f"Model {model} not found in available models: {list(MODEL_CLIENTS.keys())}")
+            logger.warning("Model %s not found in available models: %s", model, list(MODEL_CLIENTS))
             if not MODEL_CLIENTS:
-                yield json.dumps({
+                yield encode_frame({
                     "type": "result",
                     "message": {"role": "assistant", "content": "No API keys are configured. Please add API keys to your .env file."},
                     "thread_id": thread_id
-                }) + "\n"
+                })
                 return
-            # Log available models for debugging
-            logger.warning(f"Available models: {list(MODEL_CLIENTS.keys())}")
-            logger.warning(f"Model {model} not found, using first available model")
-            # If the model doesn't exist but we have some clients, use the first available
-            model = next(iter(MODEL_CLIENTS.keys()))
-            logger.warning(f"Falling back to: {model}")
+            logger.warning("Model %s not found, using default model", model)
+            # If the model doesn't exist but we have some clients, use the default
+            model = _DEFAULT_MODEL
+            logger.warning("Falling back to: %s", model)
         
-        model_client = MODEL_CLIENTS[model]()
+        model_client = get_client(model)
         
         if not use_agent:
             # Direct model conversation with optimized streaming
@@ -470,39 +533,33 @@ async def stream_chat_response(messages, model, thread_id, use_agent, deep_resea
                 if hasattr(model_client, "astream"):
                     stream = model_client.astream(messages)
                     async for chunk in stream:
-                        chunk_content = ""
-                        if hasattr(chunk, "content") and chunk.content:
-                            chunk_content = chunk.content
-                        elif isinstance(chunk, dict) and "content" in chunk:
-                            chunk_content = chunk["content"]
-                        elif hasattr(chunk, "delta") and hasattr(chunk.delta, "content"):
-                            chunk_content = chunk.delta.content
-                        
+                        # Every configured client is a LangChain chat model streaming AIMessageChunks
+                        chunk_content = chunk.content
                         if chunk_content:
                             # Remove delay for regular chat to reduce latency
-                            yield json.dumps({
+                            yield encode_frame({
                                 "type": "chunk",
                                 "chunk": chunk_content,
                                 "thread_id": thread_id
-                            }) + "\n"
+                            })
                     
-                    yield json.dumps({
+                    yield encode_frame({
                         "type": "done",
                         "thread_id": thread_id
-                    }) + "\n"
+                    })
                     return
                 
             except Exception as model_error:
-                logger.error(f"Error in model processing: {model_error}", exc_info=True)
-                yield json.dumps({
+                logger.error("Error in model processing: %s", model_error, exc_info=True)
+                yield encode_frame({
                     "type": "result",
                     "message": {"role": "assistant", "content": f"Error: {str(model_error)}"},
                     "thread_id": thread_id
-                }) + "\n"
+                })
         
         else:
             # For agent, we need a different approach since agents don't natively stream
-            yield json.dumps({"type": "status", "status": "Processing..."}) + "\n"
+            yield encode_frame({"type": "status", "status": "Processing..."})
             
             # Prepare input state for the agent
             input_state = VaaniState(
@@ -521,20 +578,13 @@ async def stream_chat_response(messages, model, thread_id, use_agent, deep_resea
             
             # Process with agent
             try:
-                # Start a background task for the agent processing
-                async def run_agent():
-                    return await asyncio.to_thread(agt_graph.invoke, input_state, config)
-                
-                agent_task = asyncio.create_task(run_agent())
-                
-                # Wait for the task without sending status updates
-                while not agent_task.done():
-                    try:
-                        await asyncio.wait_for(asyncio.shield(agent_task), 2.0)
-                    except asyncio.TimeoutError:
-                        pass
+                # Start a background task for the agent processing (sync graph, see chat())
+                agent_task = asyncio.create_task(
+                    asyncio.to_thread(agt_graph.invoke, input_state, config)
+                )
                 
-                # Get result from completed task
+                # The "Processing..." status above is the only update; just wait for the result.
+                # A client disconnect cancels this await, but the worker thread runs to completion.
                 result = await agent_task
                 
                 # Extract response content
@@ -549,48 +599,28 @@ async def stream_chat_response(messages, model, thread_id, use_agent, deep_resea
                 else:
                     response_content = "I couldn't process your request with the AI agent. Please try again."
                 
-                # KEY CHANGE: Stream one token/chunk at a time instead of cumulative content
-                words = response_content.split(' ')
-                buffer = ""
-                word_count = 0
-                
-                for word in words:
-                    buffer += word + " "
-                    word_count += 1
-                    
-                    # Send after every few words or punctuation
-                    if word_count >= 3 or any(char in word for char in ['.', '!', '?', '\n']):
-                        yield json.dumps({
-                            "type": "chunk",
-                            "chunk": buffer,
-                            "thread_id": thread_id
-                        }) + "\n"
-                        buffer = ""
-                        word_count = 0
-                        await asyncio.sleep(random.uniform(0.005, 0.015))
-                
-                # Send final complete message
-                yield json.dumps({
+                # The agent response is already complete, so send it in a single frame
+                yield encode_frame({
                     "type": "result",
                     "message": {"role": "assistant", "content": response_content},
                     "thread_id": thread_id
-                }) + "\n"
+                })
                 
             except Exception as invoke_error:
-                logger.error(f"Error in agent processing: {invoke_error}", exc_info=True)
-                yield json.dumps({
+                logger.error("Error in agent processing: %s", invoke_error, exc_info=True)
+                yield encode_frame({
                     "type": "result",
                     "message": {"role": "assistant", "content": f"I encountered an error with the AI agent: {str(invoke_error)}"},
                     "thread_id": thread_id
-                }) + "\n"
+                })
     
     except Exception as e:
-        logger.error(f"Error in streaming chat response: {e}", exc_info=True)
-        yield json.dumps({
+        logger.error("Error in streaming chat response: %s", e, exc_info=True)
+        yield encode_frame({
             "type": "result",
             "message": {"role": "assistant", "content": f"I encountered an error: {str(e)}"},
             "thread_id": thread_id
-        }) + "\n"
+        })
 
 @app.get("/api/models")
 async def get_available_models():
@@ -598,6 +628,107 @@ async def get_available_models():
     available_models = list(MODEL_CLIENTS.keys())
     return {"models": available_models}
 
+def _extract_sources(messages):
+    """Collect search result sources from the agent's search tool results, deduplicated by URL."""
+    seen = {}
+    for msg in messages:
+        # ToolNode stores the search tool's result list as JSON text on the ToolMessage
+        if not isinstance(msg, ToolMessage) or msg.name != "search":
+            continue
+        output = msg.content
+        if isinstance(output, str):
+            try:
+                output = orjson.loads(output)
+            except orjson.JSONDecodeError:
+                continue
+        if not isinstance(output, list):
+            continue
+        for item in output:
+            if not isinstance(item, dict):
+                continue
+            url = item.get("url")
+            if url and url not in seen:
+                # Tavily results do not always carry a title
+                seen[url] = item.get("title") or url
+    return [{"url": url, "title": title} for url, title in seen.items()]
+
+# Overall time budget for a react agent invocation, including the fallback attempt
+REACT_INVOKE_TIMEOUT = 120.0
+
+def react_run_config(thread_id: str, model: str, max_search_results: int) -> Dict[str, Any]:
+    """Build the runnable config for a react agent run.
+
+    Configuration.from_runnable_config only reads configurable keys named after its
+    fields, so the model and result count are passed as top-level configurable values.
+    """
+    return {"configurable": {
+        "thread_id": thread_id,
+        "model": model,
+        "max_search_results": max_search_results
+    }}
+
+async def react_invoke_with_fallback(input_state, thread_id, model, max_search_results, fallback_model=None):
+    """Invoke the react agent, retrying once with the fallback model if the primary call fails.
+
+    If the fallback fails as well, the primary model's error is raised.
+    """
+    try:
+        return await react_graph.ainvoke(input_state, react_run_config(thread_id, model, max_search_results))
+    except Exception as primary_error:
+        if not fallback_model:
+            raise
+        logger.warning("React-agent model %s failed (%s), retrying with fallback: %s", model, primary_error, fallback_model)
+        try:
+            return await react_graph.ainvoke(input_state, react_run_config(thread_id, fallback_model, max_search_results))
+        except Exception as fallback_error:
+            logger.error("Fallback react-agent model %s failed as well: %s", fallback_model, fallback_error)
+            raise primary_error
+
+# In-flight react agent invocations, so identical concurrent requests share one agent run.
+# Each entry tracks the shared task and how many callers are waiting on it. Entries are
+# removed as soon as the run finishes; past the cap requests simply run uncoalesced.
+_INFLIGHT: Dict[str, Dict[str, Any]] = {}
+_INFLIGHT_MAX = 1024
+
+def react_request_key(thread_id: str, model: str, max_search_results: int, messages: List[Message]) -> str:
+    """Build the key identifying a react agent request by its thread, settings and history."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{thread_id}|{model}|{max_search_results}".encode())
+    for msg in messages:
+        digest.update(f"|{msg.role}:{msg.content}".encode())
+    return digest.hexdigest()
+
+def _forget_inflight(key: str, entry: Dict[str, Any]) -> None:
+    """Remove an in-flight entry, unless the key already belongs to a newer run."""
+    if _INFLIGHT.get(key) is entry:
+        del _INFLIGHT[key]
+
+async def coalesce_request(key: str, run: Callable[[], Any]):
+    """Await run() once per key; concurrent callers with the same key share its result.
+
+    The shared run is cancelled once the last waiting caller goes away.
+    """
+    entry = _INFLIGHT.get(key)
+    if entry is None:
+        task = asyncio.ensure_future(run())
+        entry = {"task": task, "waiters": 0}
+        if len(_INFLIGHT) < _INFLIGHT_MAX:
+            _INFLIGHT[key] = entry
+            task.add_done_callback(lambda _: _forget_inflight(key, entry))
+    else:
+        logger.info("Joining in-flight react-agent request %s", key)
+
+    entry["waiters"] += 1
+    try:
+        # Shield the shared run so one caller going away does not cancel it for the others
+        return await asyncio.shield(entry["task"])
+    finally:
+        entry["waiters"] -= 1
+        if entry["waiters"] == 0 and not entry["task"].done():
+            # Nobody is waiting any more; stop the run and don't let new callers join it
+            _forget_inflight(key, entry)
+            entry["task"].cancel()
+
 @app.post("/api/react-search")
 async def react_agent_search(request: ReactAgentRequest):
     """Process a chat message using the ReAct agent with search capabilities."""
@@ -606,15 +737,14 @@ async def react_agent_search(request: ReactAgentRequest):
         thread_id = request.thread_id or str(uuid.uuid4())
         
         # Convert frontend messages to LangChain format
-        langchain_messages = []
-        for msg in request.messages:
-            if msg.role == "user":
-                langchain_messages.append(HumanMessage(content=msg.content))
-            elif msg.role == "assistant":
-                langchain_messages.append(AIMessage(content=msg.content))
+        langchain_messages = [
+            _ROLE_MAP[msg.role](content=msg.content)
+            for msg in request.messages
+            if msg.role in _ROLE_MAP
+        ]
         
         # Log the request
-        logger.info(f"Received react-agent request: model={request.model}, thread_id={thread_id}")
+        logger.info("Received react-agent request: model=%s, thread_id=%s", request.model, thread_id)
         
         # Prepare input state for the ReAct agent - without memory_config
         input_state = InputState(
@@ -622,97 +752,73 @@ async def react_agent_search(request: ReactAgentRequest):
             # Don't include memory_config parameter as it doesn't exist
         )
         
-        # Map the model names to the format expected by react_agent with correct handling
-        model_mapping = {
-            "gemini-1.5-flash": "google/gemini-1.5-flash",
-            "gpt-4o-mini": "openai/gpt-4o-mini",
-            "gpt-4o": "openai/gpt-4o",  # Fixed duplicate with unique value
-            "claude-3-haiku-20240307": "anthropic/claude-3-haiku-20240307",
-            "llama-3.3-70b-versatile": "groq/llama-3.3-70b-versatile",
-            "mixtral-8x7b-32768": "groq/mixtral-8x7b-32768"
-        }
-        
         # Use mapped model name with fallback handling
-        agent_model = model_mapping.get(request.model)
+        agent_model = MODEL_NAME_MAPPING.get(request.model)
         if not agent_model:
             # If model not found in mapping, use default format
-            logger.warning(f"Model {request.model} not found in mapping, using default format")
+            logger.warning("Model %s not found in mapping, using default format", request.model)
             agent_model = f"default/{request.model}"
         
-        # Create configuration
-        config = Configuration(
-            model=agent_model,
-            max_search_results=request.max_search_results
-        )
-        
         # Add fallback model logic (this is still good to keep)
-        available_models = list(MODEL_CLIENTS.keys())
-        fallback_models = []
-        
-        for model_id in ["gpt-4o-mini", "gemini-1.5-flash", "llama-3.3-70b-versatile"]:
-            mapped_name = model_mapping.get(model_id)
-            if model_id in available_models and mapped_name != agent_model:
-                fallback_models.append(mapped_name)
+        fallback_model = next(
+            (
+                MODEL_NAME_MAPPING[model_id]
+                for model_id in FALLBACK_ORDER
+                if model_id in MODEL_CLIENTS and MODEL_NAME_MAPPING[model_id] != agent_model
+            ),
+            None
+        )
         
-        if fallback_models:
-            config.fallback_model = fallback_models[0]
-            logger.info(f"Setting fallback model to: {fallback_models[0]}")
+        if fallback_model:
+            logger.info("Setting fallback model to: %s", fallback_model)
         
         # Invoke the ReAct agent ASYNCHRONOUSLY
         try:
-            logger.info(f"Processing with react-agent: {agent_model}, max_results={request.max_search_results}")
+            logger.info("Processing with react-agent: %s, max_results=%s", agent_model, request.max_search_results)
             
-            # Use the async API directly instead of asyncio.to_thread
-            result = await react_graph.ainvoke(
-                input_state, 
-                {"configurable": {"thread_id": thread_id, "configuration": config}}
+            # Retry with the fallback model if the primary fails, within an overall time budget.
+            # Identical concurrent requests (e.g. page reloads) share a single agent run.
+            result = await coalesce_request(
+                react_request_key(thread_id, request.model, request.max_search_results, request.messages),
+                lambda: asyncio.wait_for(
+                    react_invoke_with_fallback(
+                        input_state, thread_id, agent_model, request.max_search_results, fallback_model
+                    ),
+                    REACT_INVOKE_TIMEOUT
+                )
             )
             
             # Extract the assistant's response - FIX: Check the correct structure
             # The result is an AddableValuesDict and messages are accessed differently
             if "messages" in result and result["messages"]:
                 ai_message = result["messages"][-1]
-                response_content = ai_message.content
+                response_content = _message_text(ai_message)
                 
                 # Add source citation formatting to ensure search results are properly cited
-                search_tool_outputs = [msg for msg in result["messages"] if hasattr(msg, "tool_calls") and msg.tool_calls]
-                
-                if search_tool_outputs:
-                    sources = []
-                    for msg in search_tool_outputs:
-                        for tool_call in msg.tool_calls:
-                            if tool_call.get("name") == "search" and tool_call.get("output"):
-                                tool_output = tool_call.get("output")
-                                if isinstance(tool_output, list):
-                                    for item in tool_output:
-                                        if item.get("url") and item.get("title"):
-                                            sources.append({
-                                                'url': item.get('url'),
-                                                'title': item.get('title')
-                                            })
-                    
-                    if sources:
-                        response_content += format_source_urls(sources)
+                sources = _extract_sources(result["messages"])
+                if sources:
+                    response_content += format_source_urls(sources)
             else:
                 logger.warning("No messages found in react-agent result")
                 response_content = "I couldn't find any useful information. Please try a different query."
                 
         except anthropic.InternalServerError as anthropic_error:
             # Handle Claude API overloaded errors specifically
-            logger.error(f"Claude API error: {anthropic_error}")
+            logger.error("Claude API error: %s", anthropic_error)
             return ChatResponse(
                 message=Message(role="assistant", content="Sorry, the AI service is currently experiencing high load. Please try again in a few moments or switch to a different model."),
                 thread_id=thread_id
             )
         except Exception as agent_error:
-            logger.error(f"Error in react-agent processing: {agent_error}", exc_info=True)
+            logger.error("Error in react-agent processing: %s", agent_error, exc_info=True)
             return ChatResponse(
                 message=Message(role="assistant", content=f"I encountered an error with the research agent: {str(agent_error)}"),
                 thread_id=thread_id
             )
             
         # Return the response
-        logger.info(f"Generated react-agent response (first 100 chars): {response_content[:100]}...")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Generated react-agent response (first 100 chars): %s...", response_content[:100])
         
         return ChatResponse(
             message=Message(role="assistant", content=response_content),
@@ -720,156 +826,241 @@ async def react_agent_search(request: ReactAgentRequest):
         )
         
     except Exception as e:
-        logger.error(f"Error processing react-agent request: {e}", exc_info=True)
+        logger.error("Error processing react-agent request: %s", e, exc_info=True)
         return ChatResponse(
             message=Message(role="assistant", content=f"I encountered an error with the research agent: {str(e)}"),
             thread_id=thread_id or str(uuid.uuid4())
         )
 
+# A word with its surrounding whitespace, and the sentence punctuation that ends a
+# streamed word group early
+_WORD_RE = re.compile(r'\s*\S+\s*')
+_FLUSH_RE = re.compile(r'[.!?\n]')
+
+# Streamed model tokens are coalesced into frames of at least this many characters
+# (or up to sentence punctuation) to cut per-frame serialization and socket writes
+_CHUNK_COALESCE_SIZE = 256
+
+def chunk_frame_encoder(thread_id: str) -> Callable[[str], Dict[str, str]]:
+    """Return an encoder for chunk frames with the constant JSON envelope prebuilt for a thread."""
+    prefix = '{"type":"chunk","chunk":'
+    suffix = ',"thread_id":' + orjson.dumps(thread_id).decode() + '}'
+    return lambda chunk: {"event": "chunk", "data": prefix + orjson.dumps(chunk).decode() + suffix}
+
+# Exact-match cache of react-search responses and their sources, keyed by react_request_key()
+# over the full conversation. Only requests with a client-supplied thread_id are cached, since a
+# generated one can never repeat. Entries expire after _RESPONSE_CACHE_TTL seconds so web search
+# results do not go stale, and the least recently used entry is evicted past _RESPONSE_CACHE_MAX.
+# Within the TTL, re-sending identical history (e.g. a "regenerate") replays the cached answer.
+_RESPONSE_CACHE: "OrderedDict[str, Tuple[float, str, List[Dict[str, str]]]]" = OrderedDict()
+_RESPONSE_CACHE_MAX = 1024
+_RESPONSE_CACHE_TTL = 600.0
+
+def get_cached_response(key: str) -> Optional[Tuple[str, List[Dict[str, str]]]]:
+    """Return a cached (content, sources) pair, dropping the entry if it has expired."""
+    entry = _RESPONSE_CACHE.get(key)
+    if entry is None:
+        return None
+    stored_at, content, sources = entry
+    if time.monotonic() - stored_at > _RESPONSE_CACHE_TTL:
+        del _RESPONSE_CACHE[key]
+        return None
+    _RESPONSE_CACHE.move_to_end(key)
+    return content, sources
+
+def cache_response(key: str, content: str, sources: List[Dict[str, str]]) -> None:
+    """Store a react-search response and its sources in the LRU cache."""
+    _RESPONSE_CACHE[key] = (time.monotonic(), content, sources)
+    _RESPONSE_CACHE.move_to_end(key)
+    if len(_RESPONSE_CACHE) > _RESPONSE_CACHE_MAX:
+        _RESPONSE_CACHE.popitem(last=False)
+
+# Text shorter than this fits comfortably in a single frame and is not split into words
+_SHORT_TEXT_CHARS = 200
+
+def _message_text(msg) -> str:
+    """Return the text of a message or message chunk without stripping it.
+
+    Providers such as Anthropic stream content as a list of blocks once tools are bound;
+    only the text blocks are kept, and token boundaries keep their whitespace.
+    """
+    content = msg.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in content
+        if isinstance(block, str) or block.get("type", "text") == "text"
+    )
+
+def split_word_chunks(text: str):
+    """Yield text in groups of a few words, breaking early after sentence punctuation."""
+    if len(text) < _SHORT_TEXT_CHARS:
+        if text:
+            yield text
+        return
+    
+    buffer = io.StringIO()
+    word_count = 0
+    for match in _WORD_RE.finditer(text):
+        word = match.group(0)
+        buffer.write(word)
+        word_count += 1
+        
+        # Send after every few words or punctuation
+        if word_count >= 3 or _FLUSH_RE.search(word):
+            yield buffer.getvalue()
+            buffer = io.StringIO()
+            word_count = 0
+    
+    # Send any remaining buffer
+    if word_count:
+        yield buffer.getvalue()
+
 @app.post("/api/react-search-streaming")
 async def react_agent_search_streaming(request: ReactAgentRequest):
     """Process a chat message using the ReAct agent with search capabilities and stream status updates."""
     
     async def event_generator():
         """Generate server-sent events with status updates."""
+        # Create or get thread ID up front so every frame, including errors, carries it
+        thread_id = request.thread_id or uuid.uuid4().hex
+        
         try:
             # Initial status
-            yield json.dumps({"type": "status", "status": "Starting research..."}) + "\n"
+            yield encode_frame({"type": "status", "status": "Starting research..."})
             
             # Convert frontend messages to LangChain format
-            langchain_messages = []
-            for msg in request.messages:
-                if msg.role == "user":
-                    langchain_messages.append(HumanMessage(content=msg.content))
-                elif msg.role == "assistant":
-                    langchain_messages.append(AIMessage(content=msg.content))
+            langchain_messages = [
+                _ROLE_MAP[msg.role](content=msg.content)
+                for msg in request.messages
+                if msg.role in _ROLE_MAP
+            ]
+            
+            encode_chunk = chunk_frame_encoder(thread_id)
             
-            # Create or get thread ID
-            thread_id = request.thread_id or str(uuid.uuid4())
+            # A repeat of the same conversation and settings is answered from the response cache
+            cache_key = (
+                react_request_key(thread_id, request.model, request.max_search_results, request.messages)
+                if request.thread_id else None
+            )
+            cached = get_cached_response(cache_key) if cache_key else None
+            if cached is not None:
+                cached_content, cached_sources = cached
+                logger.info("Serving cached react-agent response for thread %s", thread_id)
+                if cached_sources:
+                    yield encode_frame({"type": "sources", "sources": cached_sources, "thread_id": thread_id})
+                for chunk in split_word_chunks(cached_content):
+                    yield encode_chunk(chunk)
+                yield encode_frame({
+                    "type": "result",
+                    "message": {"role": "assistant", "content": cached_content},
+                    "thread_id": thread_id
+                })
+                return
             
             # Prepare input state for the ReAct agent
             input_state = InputState(messages=langchain_messages)
             
-            # Map the model names to the format expected by react_agent
-            model_mapping = {
-                "gemini-1.5-flash": "google/gemini-1.5-flash",
-                "gpt-4o-mini": "openai/gpt-4o-mini",
-                "gpt-4o": "openai/gpt-4o",
-                "claude-3-haiku-20240307": "anthropic/claude-3-haiku-20240307",
-                "llama-3.3-70b-versatile": "groq/llama-3.3-70b-versatile",
-                "mixtral-8x7b-32768": "groq/mixtral-8x7b-32768"
-            }
-            
             # Use mapped model name or fallback
-            agent_model = model_mapping.get(request.model, f"default/{request.model}")
-            
-            # Create configuration
-            config = Configuration(
-                model=agent_model,
-                max_search_results=request.max_search_results
-            )
-            
-            # Create a task to run the react_graph.ainvoke call
-            async def run_react_agent():
-                return await react_graph.ainvoke(input_state, {"configurable": {
-                    "thread_id": thread_id, 
-                    "configuration": config
-                }})
+            agent_model = MODEL_NAME_MAPPING.get(request.model) or f"default/{request.model}"
             
-            task = asyncio.create_task(run_react_agent())
+            config_dict = react_run_config(thread_id, agent_model, request.max_search_results)
             
-            # Wait for the task without sending status updates
-            while not task.done():
-                try:
-                    await asyncio.wait_for(asyncio.shield(task), 2.0)
-                except asyncio.TimeoutError:
-                    pass
-            
-            # Get result from completed task
-            result = await task
+            # Stream model tokens as they are generated and report tool calls as status updates.
+            # Iterating the events directly also lets a client disconnect cancel the agent.
+            result = None
+            sources = []
+            streamed_tokens = []
+            pending_tokens = []
+            pending_size = 0
+            async for event in react_graph.astream_events(input_state, config_dict, version="v2"):
+                kind = event["event"]
+                if kind == "on_chat_model_stream":
+                    token = _message_text(event["data"]["chunk"])
+                    if token:
+                        streamed_tokens.append(token)
+                        pending_tokens.append(token)
+                        pending_size += len(token)
+                        if pending_size >= _CHUNK_COALESCE_SIZE or _FLUSH_RE.search(token):
+                            yield encode_chunk("".join(pending_tokens))
+                            pending_tokens = []
+                            pending_size = 0
+                    continue
+                
+                # Flush coalesced tokens before anything else is reported
+                if pending_tokens:
+                    yield encode_chunk("".join(pending_tokens))
+                    pending_tokens = []
+                    pending_size = 0
+                
+                if kind == "on_chat_model_start":
+                    # Only the last model call produces the final answer
+                    streamed_tokens = []
+                elif kind == "on_chat_model_end":
+                    # Text from a turn that ends in tool calls is not part of the answer;
+                    # tell the client to drop what it has shown so far
+                    output = event["data"].get("output")
+                    if streamed_tokens and getattr(output, "tool_calls", None):
+                        yield encode_frame({"type": "reset", "thread_id": thread_id})
+                        streamed_tokens = []
+                elif kind == "on_tool_start":
+                    yield encode_frame({"type": "status", "status": f"Running {event['name']}..."})
+                elif kind == "on_tool_end":
+                    yield encode_frame({"type": "status", "status": f"Finished {event['name']}"})
+                    if event["name"] == "search":
+                        # Send each search's new sources as soon as they are found, so the client
+                        # can show them while the answer is still being written
+                        seen_urls = {source["url"] for source in sources}
+                        new_sources = [
+                            source for source in _extract_sources([event["data"].get("output")])
+                            if source["url"] not in seen_urls
+                        ]
+                        if new_sources:
+                            sources.extend(new_sources)
+                            yield encode_frame({"type": "sources", "sources": new_sources, "thread_id": thread_id})
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    # Top-level graph run finished; its output is the final state
+                    result = event["data"].get("output")
             
             # Final status update
-            yield json.dumps({"type": "status", "status": "Finalizing results..."}) + "\n"
+            yield encode_frame({"type": "status", "status": "Finalizing results..."})
             
             # Extract the assistant's response (keep existing code)
-            if "messages" in result and result["messages"]:
+            if result and result.get("messages"):
                 ai_message = result["messages"][-1]
-                response_content = ai_message.content
-                
-                # Add source citation formatting to ensure search results are properly cited
-                search_tool_outputs = [msg for msg in result["messages"] if hasattr(msg, "tool_calls") and msg.tool_calls]
-                
-                if search_tool_outputs:
-                    sources = []
-                    for msg in search_tool_outputs:
-                        for tool_call in msg.tool_calls:
-                            if tool_call.get("name") == "search" and tool_call.get("output"):
-                                tool_output = tool_call.get("output")
-                                if isinstance(tool_output, list):
-                                    for item in tool_output:
-                                        if item.get("url") and item.get("title"):
-                                            sources.append({
-                                                'url': item.get('url'),
-                                                'title': item.get('title')
-                                            })
-                    
-                    if sources:
-                        response_content += format_source_urls(sources)
+                response_content = _message_text(ai_message)
+                if cache_key:
+                    cache_response(cache_key, response_content, sources)
             else:
                 logger.warning("No messages found in react-agent result")
                 response_content = "I couldn't find any useful information. Please try a different query."
             
-            # Stream the response back word-by-word for a fluid experience
-            words = response_content.split(' ')
-            buffer = ""
-            word_count = 0
-            
-            for word in words:
-                buffer += word + " "
-                word_count += 1
-                
-                # Send after every few words or punctuation
-                if word_count >= 3 or any(char in word for char in ['.', '!', '?', '\n']):
-                    yield json.dumps({
-                        "type": "chunk",
-                        "chunk": buffer,
-                        "thread_id": thread_id
-                    }) + "\n"
-                    buffer = ""
-                    word_count = 0
-                    await asyncio.sleep(random.uniform(0.005, 0.015))
-            
-            # Send any remaining buffer
-            if buffer:
-                yield json.dumps({
-                    "type": "chunk",
-                    "chunk": buffer,
-                    "thread_id": thread_id
-                }) + "\n"
-                # Small delay before final result (also doubled)
-                await asyncio.sleep(0.025)
+            # Send whatever part of the response was not streamed as model tokens, e.g. the
+            # sources section call_model appends, or everything when the provider did not stream plain text
+            streamed_content = "".join(streamed_tokens)
+            if response_content.startswith(streamed_content):
+                for chunk in split_word_chunks(response_content[len(streamed_content):]):
+                    yield encode_chunk(chunk)
             
             # Send final result
-            yield json.dumps({
+            yield encode_frame({
                 "type": "result",
                 "message": {"role": "assistant", "content": response_content},
                 "thread_id": thread_id
-            }) + "\n"
+            })
                 
         except Exception as e:
-            logger.error(f"Error in streaming: {e}", exc_info=True)
+            logger.error("Error in streaming: %s", e, exc_info=True)
             error_result = {
                 "type": "result",
                 "message": {"role": "assistant", "content": f"I encountered an error: {str(e)}"},
-                "thread_id": thread_id or str(uuid.uuid4())
+                "thread_id": thread_id
             }
-            yield json.dumps(error_result) + "\n"
+            yield encode_frame(error_result)
     
     # Return a streaming response
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream"
-    )
+    return EventSourceResponse(event_generator(), headers=STREAM_HEADERS)
 
 # Update health check endpoint
 @app.get("/api/health")
@@ -887,30 +1078,30 @@ def format_source_urls(sources):
     if not sources:
         return ""
     
-    formatted_sources = []
-    for source in sources:
-        title = source.get('title', 'Source')
-        url = source.get('url', '')
-        if url:
-            # Clean and truncate the title if needed
-            title = title.strip()
-            if len(title) > 60:
-                title = title[:57] + "..."
-            formatted_sources.append(f"[{title}]({url})")
+    # Clean and truncate the titles if needed, skipping sources without a URL
+    formatted_sources = [
+        f"[{title if len(title := (source.get('title') or 'Source').strip()) <= 60 else title[:57] + '...'}]({url})"
+        for source in sources
+        if (url := source.get('url'))
+    ]
     
     if formatted_sources:
         return "\n\n**Sources:**\n" + "\n".join(formatted_sources)
     return ""
 
+# Instructions telling the AI how to format results for each media type
+_MEDIA_TEMPLATES = {
+    # For image generation, instruct the AI to include proper image markdown
+    "image": "For image generation of '{prompt}', please include image URLs in markdown format: ![Generated Image](URL)",
+    # For music generation, instruct the AI about audio URLs
+    "music": "For music generation of '{prompt}', please include audio URLs directly, preferably as mp3 links.",
+}
+
 # Add this function to instruct the AI about media generation
 def handle_media_generation(prompt, media_type="image"):
     """Instructs the AI to properly format media generation results."""
-    if media_type == "image":
-        # For image generation, instruct the AI to include proper image markdown
-        return f"For image generation of '{prompt}', please include image URLs in markdown format: ![Generated Image](URL)"
-    elif media_type == "music":
-        # For music generation, instruct the AI about audio URLs
-        return f"For music generation of '{prompt}', please include audio URLs directly, preferably as mp3 links."
+    template = _MEDIA_TEMPLATES.get(media_type)
+    return template.format(prompt=prompt) if template else ""
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,20 +1,20 @@
 import streamlit as st
 import os
 import uuid
-import time
 from agent import graph, VaaniState
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 import logging
 from typing import List, Dict, Any, Optional
 import re
+from pathlib import Path
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Configuration
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+UPLOAD_DIR = (Path(__file__).parent / "uploads").resolve()
+UPLOAD_DIR.mkdir(exist_ok=True)
 
 # Initialize session state
 def init_session_state():
@@ -36,15 +36,13 @@ def handle_file_upload(uploaded_file):
     if uploaded_file is None:
         return None
     try:
-        timestamp = int(time.time())
         file_extension = os.path.splitext(uploaded_file.name)[1]
-        unique_filename = f"{timestamp}_{uuid.uuid4().hex}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
+        unique_filename = f"{uuid.uuid4().hex}{file_extension}"
+        file_path = UPLOAD_DIR / unique_filename
         with open(file_path, "wb") as f:
             f.write(uploaded_file.getbuffer())
-        abs_path = os.path.abspath(file_path)
-        logger.info(f"File uploaded: {uploaded_file.name} -> {abs_path}")
-        return abs_path
+        logger.info(f"File uploaded: {uploaded_file.name} -> {file_path}")
+        return str(file_path)
     except Exception as e:
         logger.error(f"Error handling file upload: {e}")
         st.error(f"Failed to process the uploaded file: {str(e)}")